@@ -0,0 +1,158 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("qrcode")
+
+import treasure_hunt_bot
+from treasure_hunt_bot import TreasureHuntBot, _fmt_dur, handle_message
+
+CHAT_ID = 42
+
+
+def make_update(text: str):
+    """Build a minimal text message update for CHAT_ID."""
+    update = MagicMock()
+    update.message.chat_id = CHAT_ID
+    update.message.text = text
+    update.message.reply_text = AsyncMock()
+    update.message.reply_photo = AsyncMock()
+    return update
+
+
+def send(context, text: str):
+    """Feed one text message to handle_message and return its update."""
+    update = make_update(text)
+    asyncio.run(handle_message(update, context))
+    return update
+
+
+def last_reply(update) -> str:
+    return update.message.reply_text.call_args.args[0]
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    bot = TreasureHuntBot("dummy_token")
+    monkeypatch.setattr(treasure_hunt_bot, "BOT", bot)
+    return bot
+
+
+@pytest.fixture
+def context():
+    context = MagicMock()
+    context.user_data = {"waiting_for_team_name": True}
+    context.bot.send_message = AsyncMock()
+    context.bot.send_photo = AsyncMock()
+    return context
+
+
+def test_full_game_reaches_congratulations(bot, context):
+    send(context, "Pirates")
+    session = bot.game_data[CHAT_ID]
+    assert session["current_riddle"] == 0
+
+    # The opening riddle must be answered before any QR code is accepted
+    update = send(context, "TREASURE_HUNT_LOC_1_PARK")
+    assert "Devi prima rispondere" in last_reply(update)
+
+    # Stop 0 has no QR code: answering it moves straight to the next riddle
+    send(context, "Library")
+    assert session["current_riddle"] == 1
+
+    update = send(context, "TREASURE_HUNT_LOC_3_CAFE")
+    assert "non valido" in last_reply(update)
+
+    for qr_code in ("TREASURE_HUNT_LOC_1_PARK", "TREASURE_HUNT_LOC_3_CAFE"):
+        send(context, qr_code)
+
+    update = send(context, "TREASURE_HUNT_LOC_4_START")
+    assert "CONGRATULAZIONI" in last_reply(update)
+    assert session["status"] == "completed"
+    assert [game["team_name"] for game in bot.get_leaderboard()] == ["Pirates"]
+
+
+def test_repeated_opening_answer_advances_once(bot, context, monkeypatch):
+    send(context, "Pirates")
+    monkeypatch.setattr(bot, "get_photo", lambda path: b"map")
+
+    async def slow_reply_photo(**kwargs):
+        await asyncio.sleep(0)
+        return MagicMock(photo=[])
+
+    async def answer_twice():
+        updates = [make_update("library"), make_update("library")]
+        for update in updates:
+            update.message.reply_photo = slow_reply_photo
+        await asyncio.gather(*(handle_message(update, context) for update in updates))
+
+    asyncio.run(answer_twice())
+    assert bot.game_data[CHAT_ID]["current_riddle"] == 1
+
+
+def test_new_game_replaces_leaderboard_entry(bot, context):
+    session = bot.create_game_session(CHAT_ID, "Pirates")
+    while session["status"] == "active":
+        bot.advance_riddle(CHAT_ID)
+    assert len(bot.get_leaderboard()) == 1
+
+    bot.create_game_session(CHAT_ID, "Pirates")
+    assert bot.get_leaderboard() == []
+
+
+def finish_game(bot, monkeypatch, chat_id, team_name, duration, hints_used):
+    """Complete a game for chat_id that took `duration` seconds."""
+    monkeypatch.setattr(treasure_hunt_bot.time, "monotonic", lambda: 1000.0)
+    session = bot.create_game_session(chat_id, team_name)
+    session["hints_used"] = hints_used
+    monkeypatch.setattr(treasure_hunt_bot.time, "monotonic", lambda: 1000.0 + duration)
+    while session["status"] == "active":
+        bot.advance_riddle(chat_id)
+
+
+def test_leaderboard_orders_by_duration_then_hints(bot, monkeypatch):
+    finish_game(bot, monkeypatch, 1, "Slow", 200, 0)
+    finish_game(bot, monkeypatch, 2, "Hinted", 100, 2)
+    finish_game(bot, monkeypatch, 3, "Fast", 50, 5)
+    finish_game(bot, monkeypatch, 4, "Clean", 100, 0)
+
+    leaderboard = bot.get_leaderboard()
+    assert [game["team_name"] for game in leaderboard] == ["Fast", "Clean", "Hinted", "Slow"]
+    assert [game["duration"] for game in leaderboard] == [50, 100, 100, 200]
+
+
+def test_leaderboard_limit_keeps_the_top_entries(bot, monkeypatch):
+    for chat_id in range(12, 0, -1):
+        finish_game(bot, monkeypatch, chat_id, f"Team {chat_id}", chat_id * 10, 0)
+
+    top = bot.get_leaderboard(10)
+    assert [game["team_name"] for game in top] == [f"Team {i}" for i in range(1, 11)]
+    assert len(bot.get_leaderboard()) == 12
+
+
+@pytest.mark.parametrize("secs, expected", [
+    (0, "0:00:00"),
+    (59.9, "0:00:59"),
+    (3725.9, "1:02:05"),
+    (90000, "25:00:00"),
+])
+def test_fmt_dur(secs, expected):
+    assert _fmt_dur(secs) == expected
+
+
+def test_save_qr_code_images_writes_files_and_summary(bot, tmp_path):
+    assert bot.save_qr_code_images(str(tmp_path))
+
+    # Stop 1 (the opening riddle) has no QR code to print
+    pngs = ["stop_02_park.png", "stop_03_cafe.png", "stop_04_start.png"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(pngs + ["qr_codes_summary.txt"])
+    for name in pngs:
+        assert (tmp_path / name).read_bytes().startswith(b"\x89PNG\r\n\x1a\n")
+
+    summary = (tmp_path / "qr_codes_summary.txt").read_text()
+    assert summary.startswith("TREASURE HUNT QR CODES SUMMARY\n")
+    assert summary.count("QR Code Data: TREASURE_HUNT_") == 3
+    for name in pngs:
+        assert f"File: {name}\n" in summary
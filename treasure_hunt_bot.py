@@ -1,10 +1,15 @@
 import logging
 import json
 import hashlib
+import html
+import bisect
+import functools
 import os
+import re
+import time
 import qrcode
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -17,12 +22,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Payload of the QR codes placed at each location
+_QR_RE = re.compile(r'^TREASURE_HUNT_[A-Z0-9_]+$')
+
+# Buffer size for reading images and writing QR images and the summary file
+IO_BUFFER_SIZE = 1 << 18
+
+WELCOME_TEXT = """
+🏴‍☠️ <b>Welcome to the Treasure Hunt!</b> 🏴‍☠️
+
+Ready for an adventure? This is a QR code-based treasure hunt game where you'll solve riddles and find locations around the event!
+
+<b>How it works:</b>
+1. Start a new game and register your team
+2. Receive your first riddle
+3. Solve the riddle to find a location
+4. Scan the QR code at that location
+5. Get your next riddle and repeat!
+
+Good luck, treasure hunters! 🗺️✨
+"""
+
+HELP_TEXT = """
+📖 <b>How to Play the Treasure Hunt</b>
+
+1. <b>Start a Game</b>: Register your team name
+2. <b>Read the Riddle</b>: Each riddle points to a location
+3. <b>Find the Location</b>: Use the riddle clues to find where to go
+4. <b>Scan QR Code</b>: Once there, scan the QR code to confirm your arrival
+5. <b>Next Riddle</b>: Get your next challenge!
+
+<b>Tips:</b>
+- Work as a team to solve riddles faster
+- Use hints sparingly - they affect your leaderboard position
+- QR codes are hidden at each location
+- Have fun exploring! 🎉
+
+<b>Commands:</b>
+- /start - Return to main menu
+- /hint - Get a hint for current riddle
+- /status - Check your current progress
+"""
+
+# Inline keyboards are immutable, so they are built once and shared
+_HINT_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("💡 Get Hint", callback_data="hint")]])
+
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Start New Game", callback_data="new_game")],
+    [InlineKeyboardButton("📊 Leaderboard", callback_data="leaderboard")],
+    [InlineKeyboardButton("ℹ️ How to Play", callback_data="help")]
+])
+
+
+def _fmt_dur(secs: float) -> str:
+    """Format a duration in seconds as H:MM:SS."""
+    s = int(secs)
+    return f"{s // 3600:d}:{(s // 60) % 60:02d}:{s % 60:02d}"
+
+
+def _render_one(args):
+    """Encode a single QR code and save it as a PNG file (runs in a worker process)."""
+    qr_data, filepath = args
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    
+    # Encode in memory and write the PNG in a single call
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    with open(filepath, 'wb', buffering=IO_BUFFER_SIZE) as f:
+        f.write(buf.getvalue())
+    return filepath
+
+
 class TreasureHuntBot:
     def __init__(self, token: str):
         self.token = token
         self.game_data = {}  # In production, use a database
         self.riddles = self.load_riddles()
-        self.qr_codes = self.generate_qr_codes()
+        self.prepare_riddle_texts()
+        self.file_ids: Dict[str, str] = {}  # Telegram file_id of already uploaded images
+        self._qr_to_index = {
+            r["qr_code"]: i for i, r in enumerate(self.riddles) if r["qr_code"] != "N/A"
+        }
+        # Completed games kept sorted by (duration, hints_used)
+        self.leaderboard = []
+        self._leaderboard_keys = []
         
     def load_riddles(self) -> List[Dict]:
         """Load riddles and their locations. Customize this for your event."""
@@ -75,59 +166,77 @@ class TreasureHuntBot:
             # }
         ]
     
-    def generate_qr_codes(self) -> Dict[str, str]:
-        """Generate QR codes for each location."""
-        qr_codes = {}
+    def prepare_riddle_texts(self):
+        """Precompute the message text sent for each riddle."""
+        for riddle in self.riddles:
+            body = (
+                f"🧩 <b>Riddle #{riddle['id']}:</b>\n{html.escape(riddle['riddle'])}\n\n"
+                "Find the location and scan the QR code there!"
+            )
+            riddle["_text_body"] = body
+            riddle["_text_no_team"] = "✅ <b>Great job!</b> Location found!\n\n" + body
+    
+    @functools.cached_property
+    def image_cache(self) -> Dict[str, bytes]:
+        """Riddle and map images read into memory on first send, so they are not reopened every time."""
+        images = {}
         for riddle in self.riddles:
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(riddle["qr_code"])
-            qr.make(fit=True)
-            qr_codes[riddle["qr_code"]] = qr
-        return qr_codes
+            for path in (riddle.get("image_path"), riddle.get("map_path")):
+                if path and path not in images and os.path.isfile(path):
+                    with open(path, "rb", buffering=IO_BUFFER_SIZE) as f:
+                        images[path] = f.read()
+        return images
+    
+    def get_photo(self, path: Optional[str]):
+        """Get the photo to send for an image path: its file_id if already uploaded, else its bytes."""
+        return self.file_ids.get(path) or self.image_cache.get(path)
+    
+    def remember_file_id(self, path: str, message):
+        """Remember the file_id Telegram assigned to an uploaded image."""
+        if message.photo:
+            self.file_ids[path] = message.photo[-1].file_id
     
     def save_qr_code_images(self, output_dir: str = "qr_codes"):
         """Save QR code images to files for printing."""
-        import os
-        
-        # Create output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        # Resolve the output directory once and create it if it doesn't exist
+        out = os.path.abspath(output_dir)
+        os.makedirs(out, exist_ok=True)
         
+        jobs = []
         for i, riddle in enumerate(self.riddles, 1):
-            qr_code_data = riddle["qr_code"]
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_code_data)
-            qr.make(fit=True)
-            
-            # Create QR code image
-            img = qr.make_image(fill_color="black", back_color="white")
+            # Stop 0 has no QR code to print
+            if riddle["qr_code"] == "N/A":
+                continue
             
             # Save with descriptive filename
             filename = f"stop_{i:02d}_{riddle['location']}.png"
-            filepath = os.path.join(output_dir, filename)
-            img.save(filepath)
-            
-            print(f"✅ Generated QR code for Stop {i} ({riddle['location']}): {filepath}")
+            jobs.append((i, riddle, filename, (riddle["qr_code"], f"{out}/{filename}")))
+        
+        # Each stop is independent, so encode and render them in parallel
+        if jobs:
+            max_workers = min(len(jobs), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                filepaths = executor.map(_render_one, [args for _, _, _, args in jobs])
+                for (i, riddle, _, _), filepath in zip(jobs, filepaths):
+                    print(f"✅ Generated QR code for Stop {i} ({riddle['location']}): {filepath}")
         
-        print(f"\n🎯 Total QR codes generated: {len(self.riddles)}")
-        print(f"📁 Files saved in: {output_dir}/")
+        print(f"\n🎯 Total QR codes generated: {len(jobs)}")
+        print(f"📁 Files saved in: {out}/")
         
         # Also create a summary file
-        summary_path = os.path.join(output_dir, "qr_codes_summary.txt")
-        with open(summary_path, 'w') as f:
-            f.write("TREASURE HUNT QR CODES SUMMARY\n")
-            f.write("=" * 50 + "\n\n")
-            for i, riddle in enumerate(self.riddles, 1):
-                f.write(f"Stop {i}: {riddle['location'].upper()}\n")
-                f.write(f"QR Code Data: {riddle['qr_code']}\n")
-                f.write(f"Riddle: {riddle['riddle']}\n")
-                f.write(f"Hint: {riddle['hint']}\n")
-                f.write(f"File: stop_{i:02d}_{riddle['location']}.png\n")
-                f.write("-" * 30 + "\n")
+        summary_path = f"{out}/qr_codes_summary.txt"
+        blocks = ["TREASURE HUNT QR CODES SUMMARY\n" + "=" * 50 + "\n\n"]
+        blocks += [
+            f"Stop {i}: {riddle['location'].upper()}\n"
+            f"QR Code Data: {riddle['qr_code']}\n"
+            f"Riddle: {riddle['riddle']}\n"
+            f"Hint: {riddle['hint']}\n"
+            f"File: {filename}\n"
+            + "-" * 30 + "\n"
+            for i, riddle, filename, _ in jobs
+        ]
+        with open(summary_path, 'w', buffering=IO_BUFFER_SIZE) as f:
+            f.write("".join(blocks))
         
         print(f"📋 Summary saved to: {summary_path}")
         return True
@@ -137,11 +246,13 @@ class TreasureHuntBot:
         session = {
             "team_name": team_name,
             "current_riddle": 0,
-            "start_time": datetime.now(),
+            "start_time": time.monotonic(),
             "completed_riddles": [],
             "hints_used": 0,
             "status": "active"
         }
+        # A new game replaces the chat's previous one, including its leaderboard entry
+        self._remove_from_leaderboard(chat_id)
         self.game_data[chat_id] = session
         return session
     
@@ -158,11 +269,11 @@ class TreasureHuntBot:
     
     def validate_qr_code(self, chat_id: int, qr_data: str) -> bool:
         """Validate if the scanned QR code is correct for current riddle."""
-        current_riddle = self.get_current_riddle(chat_id)
-        if not current_riddle:
+        session = self.game_data.get(chat_id)
+        if not session:
             return False
         
-        return qr_data == current_riddle["qr_code"]
+        return self._qr_to_index.get(qr_data) == session["current_riddle"]
     
     def advance_riddle(self, chat_id: int) -> bool:
         """Advance to the next riddle."""
@@ -175,280 +286,268 @@ class TreasureHuntBot:
         
         if session["current_riddle"] >= len(self.riddles):
             session["status"] = "completed"
-            session["end_time"] = datetime.now()
+            session["end_time"] = time.monotonic()
+            self._add_to_leaderboard(chat_id, session)
         
         return True
     
-    def get_leaderboard(self) -> List[Dict]:
-        """Get the leaderboard of completed games."""
-        completed_games = []
-        for chat_id, session in self.game_data.items():
-            if session["status"] == "completed":
-                duration = session["end_time"] - session["start_time"]
-                completed_games.append({
-                    "team_name": session["team_name"],
-                    "duration": duration,
-                    "hints_used": session["hints_used"],
-                    "chat_id": chat_id
-                })
+    def _add_to_leaderboard(self, chat_id: int, session: Dict):
+        """Insert a completed game into the sorted leaderboard."""
+        duration = session["end_time"] - session["start_time"]
+        key = (duration, session["hints_used"])
         
         # Sort by duration (fastest first), then by hints used (fewer is better)
-        completed_games.sort(key=lambda x: (x["duration"], x["hints_used"]))
-        return completed_games
+        index = bisect.bisect_right(self._leaderboard_keys, key)
+        self._leaderboard_keys.insert(index, key)
+        self.leaderboard.insert(index, {
+            "team_name": session["team_name"],
+            "duration": duration,
+            "hints_used": session["hints_used"],
+            "chat_id": chat_id
+        })
+    
+    def _remove_from_leaderboard(self, chat_id: int):
+        """Remove a chat's completed game from the leaderboard, if present."""
+        for index, game in enumerate(self.leaderboard):
+            if game["chat_id"] == chat_id:
+                del self.leaderboard[index]
+                del self._leaderboard_keys[index]
+                return
+    
+    def get_leaderboard(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get the leaderboard of completed games, optionally only the top `limit`."""
+        return self.leaderboard[:limit]
+
+
+# Bot instance used by the handlers, set in main() before polling starts
+BOT: Optional[TreasureHuntBot] = None
 
 
-async def send_riddle(context, bot_instance, chat_id: int, team_name: str = None):
-    current_riddle = bot_instance.get_current_riddle(chat_id)
+async def send_riddle(context, chat_id: int, team_name: str = None):
+    current_riddle = BOT.get_current_riddle(chat_id)
     if not current_riddle:
         await context.bot.send_message(chat_id=chat_id, text="❌ No active riddle found.")
         return
 
-    keyboard = [[InlineKeyboardButton("💡 Get Hint", callback_data="hint")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    riddle_text = ""
     if team_name:
-        riddle_text += f"🎯 **Team:** {team_name}\n\n"
+        riddle_text = f"🎯 <b>Team:</b> {html.escape(team_name)}\n\n" + current_riddle["_text_body"]
     else:
-        riddle_text += f"✅ **Great job!** Location found!\n\n"
-
-    riddle_text += f"🧩 **Riddle #{current_riddle['id']}:**\n{current_riddle['riddle']}\n\n"
-    riddle_text += "Find the location and scan the QR code there!"
+        riddle_text = current_riddle["_text_no_team"]
 
-    # 📸 Invia immagine se presente e se il file esiste
+    # 📸 Invia immagine con il testo come didascalia, se presente
     image_path = current_riddle.get("image_path")
-    if image_path and os.path.isfile(image_path):
+    photo = BOT.get_photo(image_path)
+    if photo:
         try:
-            with open(image_path, "rb") as img:
-                await context.bot.send_photo(chat_id=chat_id, photo=img)
+            message = await context.bot.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=riddle_text,
+                reply_markup=_HINT_MARKUP,
+                parse_mode='HTML'
+            )
+            BOT.remember_file_id(image_path, message)
+            return
         except Exception as e:
-            await context.bot.send_message(chat_id=chat_id, text="⚠️ Could not load image for this riddle.")
+            logger.warning(f"Could not send image for riddle {current_riddle['id']}: {e}")
     else:
         # Log utile per il debug (facoltativo)
         logger.info(f"No image found for riddle {current_riddle['id']} (image_path: {image_path})")
 
     # 🧩 Invia il testo dell'indovinello
-    await context.bot.send_message(chat_id=chat_id, text=riddle_text, reply_markup=reply_markup, parse_mode='Markdown')
+    await context.bot.send_message(chat_id=chat_id, text=riddle_text, reply_markup=_HINT_MARKUP, parse_mode='HTML')
 
 
 
 
-# Bot command handlers
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Start command handler."""
-    keyboard = [
-        [InlineKeyboardButton("🎮 Start New Game", callback_data="new_game")],
-        [InlineKeyboardButton("📊 Leaderboard", callback_data="leaderboard")],
-        [InlineKeyboardButton("ℹ️ How to Play", callback_data="help")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = """
-🏴‍☠️ **Welcome to the Treasure Hunt!** 🏴‍☠️
+async def send_next(update: Update, context, session: Dict):
+    """After advance_riddle, send the team its next riddle, or congratulate it if the hunt is over."""
+    if session["status"] == "completed":
+        duration = session["end_time"] - session["start_time"]
+        await update.message.reply_text(
+            f"🏆 <b>CONGRATULAZIONI</b>\nHai completato la caccia al tesoro!\n⏱️ Tempo: {_fmt_dur(duration)}\n💡 Suggerimenti: {session['hints_used']}",
+            parse_mode="HTML"
+        )
+        return
 
-Ready for an adventure? This is a QR code-based treasure hunt game where you'll solve riddles and find locations around the event!
+    # Invia nuovo riddle
+    await send_riddle(context, update.message.chat_id)
 
-**How it works:**
-1. Start a new game and register your team
-2. Receive your first riddle
-3. Solve the riddle to find a location
-4. Scan the QR code at that location
-5. Get your next riddle and repeat!
 
-Good luck, treasure hunters! 🗺️✨
-    """
-    
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+async def _edit(query, text: str, **kwargs):
+    """Edit the message a button belongs to, whether it is a text or a captioned photo."""
+    # Riddles with an image are sent as a photo with caption, which has no text to edit
+    if query.message.photo:
+        await query.edit_message_caption(text, **kwargs)
+    else:
+        await query.edit_message_text(text, **kwargs)
+
+
+# Bot command handlers
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start command handler."""
+    await update.message.reply_text(WELCOME_TEXT, reply_markup=_MAIN_MENU_MARKUP, parse_mode='HTML')
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks."""
     query = update.callback_query
     await query.answer()
     
-    bot_instance = context.bot_data.get('bot_instance')
-    if not bot_instance:
-        await query.edit_message_text("❌ Bot not properly initialized. Please restart.")
-        return
-    
     if query.data == "new_game":
         await query.edit_message_text("🎯 Please enter your team name:")
         context.user_data['waiting_for_team_name'] = True
     
     elif query.data == "leaderboard":
-        leaderboard = bot_instance.get_leaderboard()
+        leaderboard = BOT.get_leaderboard(10)
         if not leaderboard:
             await query.edit_message_text("📊 No completed games yet! Be the first to finish! 🏆")
             return
         
-        leaderboard_text = "🏆 **LEADERBOARD** 🏆\n\n"
-        for i, game in enumerate(leaderboard[:10], 1):
-            duration_str = str(game["duration"]).split('.')[0]  # Remove microseconds
-            leaderboard_text += f"{i}. **{game['team_name']}**\n"
-            leaderboard_text += f"   ⏱️ Time: {duration_str}\n"
-            leaderboard_text += f"   💡 Hints used: {game['hints_used']}\n\n"
+        parts = ["🏆 <b>LEADERBOARD</b> 🏆\n\n"]
+        for i, game in enumerate(leaderboard, 1):
+            parts.append(
+                f"{i}. <b>{html.escape(game['team_name'])}</b>\n"
+                f"   ⏱️ Time: {_fmt_dur(game['duration'])}\n"
+                f"   💡 Hints used: {game['hints_used']}\n\n"
+            )
+        leaderboard_text = "".join(parts)
         
-        await query.edit_message_text(leaderboard_text, parse_mode='Markdown')
+        await query.edit_message_text(leaderboard_text, parse_mode='HTML')
     
     elif query.data == "help":
-        help_text = """
-📖 **How to Play the Treasure Hunt**
-
-1. **Start a Game**: Register your team name
-2. **Read the Riddle**: Each riddle points to a location
-3. **Find the Location**: Use the riddle clues to find where to go
-4. **Scan QR Code**: Once there, scan the QR code to confirm your arrival
-5. **Next Riddle**: Get your next challenge!
-
-**Tips:**
-- Work as a team to solve riddles faster
-- Use hints sparingly - they affect your leaderboard position
-- QR codes are hidden at each location
-- Have fun exploring! 🎉
-
-**Commands:**
-- /start - Return to main menu
-- /hint - Get a hint for current riddle
-- /status - Check your current progress
-        """
-        await query.edit_message_text(help_text, parse_mode='Markdown')
+        await query.edit_message_text(HELP_TEXT, parse_mode='HTML')
     
     elif query.data == "hint":
-        current_riddle = bot_instance.get_current_riddle(query.message.chat_id)
+        current_riddle = BOT.get_current_riddle(query.message.chat_id)
         if current_riddle:
-            bot_instance.game_data[query.message.chat_id]["hints_used"] += 1
-            await query.edit_message_text(f"💡 **Hint:** {current_riddle['hint']}")
+            BOT.game_data[query.message.chat_id]["hints_used"] += 1
+            await _edit(query, f"💡 <b>Hint:</b> {html.escape(current_riddle['hint'])}", parse_mode='HTML')
         else:
-            await query.edit_message_text("❌ No active riddle to get a hint for!")
+            await _edit(query, "❌ No active riddle to get a hint for!")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    bot_instance = context.bot_data.get('bot_instance')
-    if not bot_instance:
-        await update.message.reply_text("❌ Bot not properly initialized. Please restart.")
-        return
-    
     chat_id = update.message.chat_id
-    text = update.message.text.strip().lower()
+    text = update.message.text.strip()
     
     # Check if waiting for team name
     if context.user_data.get('waiting_for_team_name'):
-        team_name = text.strip()
+        team_name = text
         if len(team_name) < 2:
             await update.message.reply_text("❌ Team name must be at least 2 characters long!")
             return
         ## TODO: CHECK IF TEAM NAME ALREADY EXISTS
         ## TODO: CHECK IF TEAM NAME IS VALID AND NOT OFFENSIVE
 
-        bot_instance.create_game_session(chat_id, team_name)
+        BOT.create_game_session(chat_id, team_name)
         context.user_data['waiting_for_team_name'] = False
 
         # Invia il primo riddle (tappa 0)
-        await send_riddle(context, bot_instance, chat_id, team_name)
+        await send_riddle(context, chat_id, team_name)
         return
 
     # Check if it's a QR code
-    if text.startswith("TREASURE_HUNT_"):
+    if _QR_RE.match(text):
+        session = BOT.game_data.get(chat_id)
+        if not session or session["status"] != "active":
+            await update.message.reply_text("❌ Nessuna partita attiva. Usa /start per iniziare.")
+            return
+
         # CHECK answered riddle before next QR
-        if current_riddle["id"] == 0:
+        current_index = session["current_riddle"]
+        if current_index == 0:
             await update.message.reply_text("🔐 Devi prima rispondere all'indovinello iniziale!")
             return
 
-        if bot_instance.validate_qr_code(chat_id, text):
-            # Avanza al prossimo riddle (da QR)
-            bot_instance.advance_riddle(chat_id)
-
-            session = bot_instance.game_data.get(chat_id)
-            if session["status"] == "completed":
-                duration = session["end_time"] - session["start_time"]
-                await update.message.reply_text(
-                    f"🏆 *CONGRATULAZIONI*\nHai completato la caccia al tesoro!\n⏱️ Tempo: {str(duration).split('.')[0]}\n💡 Suggerimenti: {session['hints_used']}",
-                    parse_mode="Markdown"
-                )
-                return
-
-            # Invia nuovo riddle
-            await send_riddle(context, bot_instance, chat_id)
-        else:
+        if not BOT.validate_qr_code(chat_id, text):
             await update.message.reply_text("❌ QR code non valido per questa tappa.")
+            return
+
+        # Avanza al prossimo riddle (da QR)
+        BOT.advance_riddle(chat_id)
+        await send_next(update, context, session)
         return
 
     # Altrimenti, si tratta di una risposta testuale a un riddle
-    session = bot_instance.game_data.get(chat_id)
+    session = BOT.game_data.get(chat_id)
     if not session or session["status"] != "active":
         await update.message.reply_text("❌ Nessuna partita attiva. Usa /start per iniziare.")
         return
 
-    current_riddle = bot_instance.get_current_riddle(chat_id)
+    current_riddle = BOT.get_current_riddle(chat_id)
     if not current_riddle:
         await update.message.reply_text("✅ Hai già risolto tutti gli enigmi!")
         return
 
     correct_answer = current_riddle.get("answer", "").strip().lower()
-    if text == correct_answer:
-        # Risposta corretta → invia mappa per raggiungere tappa successiva
-        map_path = current_riddle.get("map_path")
-        if map_path and os.path.isfile(map_path):
-            with open(map_path, "rb") as f:
-                await update.message.reply_photo(
-                    photo=f,
-                    caption="🗺️ Ottimo! Ecco dove andare. Raggiungi il luogo e scansiona il QR per ricevere il prossimo enigma."
-                )
-        else:
-            await update.message.reply_text("✅ Risposta corretta! Raggiungi la prossima tappa e scansiona il QR.")
-
-    else:
+    if text.lower() != correct_answer:
         await update.message.reply_text("❌ Risposta sbagliata. Riprova o usa /hint.")
+        return
+
+    # Risposta corretta → invia mappa per raggiungere tappa successiva
+    has_qr = current_riddle["qr_code"] != "N/A"
+    if not has_qr:
+        # Nessun QR per questa tappa (tappa 0): la risposta basta per avanzare.
+        # Avanza prima di qualsiasi await, così una risposta ripetuta non avanza due volte
+        BOT.advance_riddle(chat_id)
+
+    map_path = current_riddle.get("map_path")
+    photo = BOT.get_photo(map_path)
+    if photo:
+        caption = "🗺️ Ottimo! Ecco dove andare."
+        if has_qr:
+            caption += " Raggiungi il luogo e scansiona il QR per ricevere il prossimo enigma."
+        message = await update.message.reply_photo(photo=photo, caption=caption)
+        BOT.remember_file_id(map_path, message)
+    elif has_qr:
+        await update.message.reply_text("✅ Risposta corretta! Raggiungi la prossima tappa e scansiona il QR.")
+
+    if not has_qr:
+        await send_next(update, context, session)
 
 
 async def hint_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Provide hint for current riddle."""
-    bot_instance = context.bot_data.get('bot_instance')
-    if not bot_instance:
-        await update.message.reply_text("❌ Bot not properly initialized. Please restart.")
-        return
-    
     chat_id = update.message.chat_id
-    current_riddle = bot_instance.get_current_riddle(chat_id)
+    current_riddle = BOT.get_current_riddle(chat_id)
     
     if not current_riddle:
         await update.message.reply_text("❌ No active game or riddle found! Start a new game first.")
         return
     
-    bot_instance.game_data[chat_id]["hints_used"] += 1
-    await update.message.reply_text(f"💡 **Hint:** {current_riddle['hint']}")
+    BOT.game_data[chat_id]["hints_used"] += 1
+    await update.message.reply_text(f"💡 <b>Hint:</b> {html.escape(current_riddle['hint'])}", parse_mode='HTML')
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show current game status."""
-    bot_instance = context.bot_data.get('bot_instance')
-    if not bot_instance:
-        await update.message.reply_text("❌ Bot not properly initialized. Please restart.")
-        return
-    
     chat_id = update.message.chat_id
-    session = bot_instance.game_data.get(chat_id)
+    session = BOT.game_data.get(chat_id)
     
     if not session:
         await update.message.reply_text("❌ No active game found! Start a new game first.")
         return
     
-    current_riddle = bot_instance.get_current_riddle(chat_id)
+    current_riddle = BOT.get_current_riddle(chat_id)
     if not current_riddle:
         await update.message.reply_text("🏆 Game completed! Great job!")
         return
     
     progress = len(session["completed_riddles"])
-    total = len(bot_instance.riddles)
-    
-    status_text = f"📊 **Game Status**\n\n"
-    status_text += f"🎯 **Team:** {session['team_name']}\n"
-    status_text += f"📈 **Progress:** {progress}/{total} riddles completed\n"
-    status_text += f"💡 **Hints Used:** {session['hints_used']}\n"
-    status_text += f"🧩 **Current Riddle:** #{current_riddle['id']}\n\n"
-    status_text += f"**Current Challenge:**\n{current_riddle['riddle']}"
+    total = len(BOT.riddles)
+    
+    status_text = (
+        "📊 <b>Game Status</b>\n\n"
+        f"🎯 <b>Team:</b> {html.escape(session['team_name'])}\n"
+        f"📈 <b>Progress:</b> {progress}/{total} riddles completed\n"
+        f"💡 <b>Hints Used:</b> {session['hints_used']}\n"
+        f"🧩 <b>Current Riddle:</b> #{current_riddle['id']}\n\n"
+        f"<b>Current Challenge:</b>\n{html.escape(current_riddle['riddle'])}"
+    )
     
-    await update.message.reply_text(status_text, parse_mode='Markdown')
+    await update.message.reply_text(status_text, parse_mode='HTML')
 
 def main():
     """Main function to run the bot."""
+    global BOT
     import argparse
     import os
     
@@ -585,11 +684,18 @@ Examples:
     # Create bot instance with real token
     bot_instance = TreasureHuntBot(args.token)
     
-    # Create application
-    application = Application.builder().token(args.token).build()
+    # Create application with a larger HTTP/2 connection pool
+    application = (
+        Application.builder()
+        .token(args.token)
+        .http_version("2")
+        .connection_pool_size(100)
+        .pool_timeout(10)
+        .build()
+    )
     
-    # Store bot instance in bot_data for access in handlers
-    application.bot_data['bot_instance'] = bot_instance
+    # Store bot instance in a module global for access in handlers
+    BOT = bot_instance
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))